@@ -6,12 +6,19 @@ DNS query support
 # Copyright (C) 2021 The Psycopg Team
 
 import os
-import re
+import sys
+import asyncio
 import warnings
-from random import randint
-from typing import Any, DefaultDict, Dict, List, NamedTuple, Optional, Sequence
-from typing import TYPE_CHECKING
-from collections import defaultdict
+import threading
+from time import monotonic, time
+from math import inf
+from random import Random
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+from typing import Tuple, TYPE_CHECKING
+from operator import attrgetter
+from itertools import groupby
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from dns.resolver import Resolver, Cache
@@ -23,6 +30,7 @@ except ImportError:
     )
 
 from . import errors as e
+from ._compat import TypeAlias
 from .conninfo import resolve_hostaddr_async as resolve_hostaddr_async_
 
 if TYPE_CHECKING:
@@ -34,6 +42,9 @@ resolver.cache = Cache()
 async_resolver = AsyncResolver()
 async_resolver.cache = Cache()
 
+# Emit the resolve_hostaddr_async() deprecation warning only once.
+_hostaddr_warned = False
+
 
 async def resolve_hostaddr_async(params: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -66,10 +77,14 @@ async def resolve_hostaddr_async(params: Dict[str, Any]) -> Dict[str, Any]:
     .. warning::
         Before psycopg 3.1, this function doesn't handle the ``/etc/hosts`` file.
     """
-    warnings.warn(
-        "from psycopg 3.1, resolve_hostaddr_async() is not needed anymore",
-        DeprecationWarning,
-    )
+    global _hostaddr_warned
+    if not _hostaddr_warned:
+        _hostaddr_warned = True
+        warnings.warn(
+            "from psycopg 3.1, resolve_hostaddr_async() is not needed anymore",
+            DeprecationWarning,
+            stacklevel=2,
+        )
     return await resolve_hostaddr_async_(params)
 
 
@@ -91,20 +106,136 @@ def resolve_srv(params: Dict[str, Any]) -> Dict[str, Any]:
     In addition to the rules defined by RFC 2782 about the host name pattern,
     perform SRV lookup also if the the port is the string ``SRV`` (case
     insensitive).
+
+    The records found are cached according to their TTL, so that repeated
+    connections to the same service don't need further DNS lookups. Failed
+    lookups are not retried for a few seconds.
     """
-    return Rfc2782Resolver().resolve(params)
+    return _resolver.resolve(params)
 
 
 async def resolve_srv_async(params: Dict[str, Any]) -> Dict[str, Any]:
     """Async equivalent of `resolve_srv()`."""
-    return await Rfc2782Resolver().resolve_async(params)
+    return await _resolver.resolve_async(params)
+
+
+def _is_srv_port(port: str) -> bool:
+    """Return True if the port is the string 'srv', case insensitive."""
+    # The length check avoids to allocate a new string for numeric ports.
+    return len(port) == 3 and port.lower() == "srv"
 
 
 class HostPort(NamedTuple):
     host: str
     port: str
-    totry: bool = False
-    target: Optional[str] = None
+
+
+# Hosts, ports, whether SRV lookup must be tried, SRV names targets.
+Attempts: TypeAlias = Tuple[List[str], List[str], List[bool], List[Optional[str]]]
+
+
+# Expiry time, records found, backoff time if the lookup failed.
+CacheItem: TypeAlias = Tuple[float, "Sequence[SRV]", float]
+
+
+class SrvCache:
+    """A bounded LRU cache of SRV answers, expiring after the records TTL.
+
+    The SRV records are cached, not the hosts selected by the resolver, so
+    that the weighted selection is performed again on every lookup.
+
+    Failed lookups are cached too, for `!failure_ttl` seconds, doubling the
+    time on every new failure of the same name, up to `!max_failure_ttl`.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        max_ttl: float = 300.0,
+        failure_ttl: float = 5.0,
+        max_failure_ttl: float = 60.0,
+    ):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.failure_ttl = failure_ttl
+        self.max_failure_ttl = max_failure_ttl
+
+        self._entries: "OrderedDict[str, CacheItem]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> "Optional[Sequence[SRV]]":
+        """
+        Return the records cached for `!host`, `!None` if not available.
+
+        Return an empty sequence if the lookup has recently failed.
+        """
+        with self._lock:
+            item = self._entries.get(host)
+            if not item:
+                return None
+            if item[0] <= monotonic():
+                # Keep the expired failures to back off if failing again.
+                if item[1]:
+                    del self._entries[host]
+                return None
+            self._entries.move_to_end(host)
+            return item[1]
+
+    def __contains__(self, host: str) -> bool:
+        """
+        Return True if there is a valid entry for `!host`.
+
+        Unlike `get()`, don't change the entries order or remove the expired.
+        """
+        with self._lock:
+            item = self._entries.get(host)
+            return bool(item) and item[0] > monotonic()
+
+    def put(self, host: str, ans: "Sequence[SRV]") -> None:
+        """Store the answer to a SRV query for `!host`."""
+        # The answer expiration accounts for the lowest TTL in the CNAME
+        # chain and for the time already spent in the dnspython cache.
+        ttl = min(ans.expiration - time(), self.max_ttl)
+        if ttl <= 0:
+            with self._lock:
+                self._entries.pop(host, None)
+            return
+        self._store(host, (monotonic() + ttl, list(ans), 0.0))
+
+    def put_failure(self, host: str) -> None:
+        """Record that the SRV query for `!host` has failed."""
+        now = monotonic()
+        backoff = self.failure_ttl
+        with self._lock:
+            item = self._entries.get(host)
+        # Double the backoff if the last failure is recent.
+        if item and item[2] and now - item[0] < self.max_failure_ttl:
+            backoff = min(item[2] * 2, self.max_failure_ttl)
+        self._store(host, (now + backoff, (), backoff))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, host: str, item: CacheItem) -> None:
+        with self._lock:
+            self._entries[host] = item
+            self._entries.move_to_end(host)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_srv_cache = SrvCache()
+
+# Random generator used for the weighted selection of SRV records.
+_random = Random()
+
+_get_host = attrgetter("host")
+_get_port = attrgetter("port")
+_get_priority = attrgetter("priority")
+
+# Async SRV queries in progress, by host name.
+_srv_pending: "Dict[str, asyncio.Future[Sequence[SRV]]]" = {}
 
 
 class Rfc2782Resolver:
@@ -114,7 +245,8 @@ class Rfc2782Resolver:
     the async paths.
     """
 
-    re_srv_rr = re.compile(r"^(?P<service>_[^\.]+)\.(?P<proto>_[^\.]+)\.(?P<target>.+)")
+    # Maximum number of threads used to look up SRV names concurrently
+    max_workers = 8
 
     def resolve(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Update the parameters host and port after SRV lookup."""
@@ -122,14 +254,27 @@ class Rfc2782Resolver:
         if not attempts:
             return params
 
-        hps = []
-        for hp in attempts:
-            if hp.totry:
-                hps.extend(self._resolve_srv(hp))
-            else:
-                hps.append(hp)
+        hosts, ports, totry, targets = attempts
+        todo = [i for i in range(len(hosts)) if totry[i]]
+
+        # The names not in cache, each one only once.
+        missing = list(
+            dict.fromkeys(hosts[i] for i in todo if hosts[i] not in _srv_cache)
+        )
+        answers: "Dict[str, Sequence[SRV]]" = {}
+        if len(missing) > 1:
+            # More than one name to query: look them up concurrently.
+            workers = min(len(missing), self.max_workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                answers = dict(zip(missing, executor.map(self._query_srv, missing)))
 
-        return self._return_params(params, hps)
+        def resolve_one(i: int) -> List[HostPort]:
+            ans = answers.get(hosts[i])
+            if ans is None:
+                return self._resolve_srv(hosts[i], ports[i], targets[i])
+            return self._get_solved_entries(ports[i], targets[i], ans)
+
+        return self._return_params(params, attempts, map(resolve_one, todo))
 
     async def resolve_async(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Update the parameters host and port after SRV lookup."""
@@ -137,28 +282,39 @@ class Rfc2782Resolver:
         if not attempts:
             return params
 
-        hps = []
-        for hp in attempts:
-            if hp.totry:
-                hps.extend(await self._resolve_srv_async(hp))
-            else:
-                hps.append(hp)
+        # Look up all the SRV names concurrently.
+        hosts, ports, totry, targets = attempts
+        results = iter(
+            await asyncio.gather(
+                *(
+                    self._resolve_srv_async(hosts[i], ports[i], targets[i])
+                    for i in range(len(hosts))
+                    if totry[i]
+                )
+            )
+        )
 
-        return self._return_params(params, hps)
+        return self._return_params(params, attempts, results)
 
-    def _get_attempts(self, params: Dict[str, Any]) -> List[HostPort]:
+    def _get_attempts(self, params: Dict[str, Any]) -> Optional[Attempts]:
         """
-        Return the list of host, and for each host if SRV lookup must be tried.
+        Return the lists of hosts and ports, and for each host if SRV lookup
+        must be tried and the target of the SRV name.
 
-        Return an empty list if no lookup is requested.
+        Return None if no lookup is requested.
         """
         # If hostaddr is defined don't do any resolution.
         if params.get("hostaddr", os.environ.get("PGHOSTADDR", "")):
-            return []
+            return None
 
         host_arg: str = params.get("host", os.environ.get("PGHOST", ""))
-        hosts_in = host_arg.split(",")
         port_arg: str = str(params.get("port", os.environ.get("PGPORT", "")))
+
+        # Quick check for the common case of no SRV name and no SRV port.
+        if "_" not in host_arg and "srv" not in port_arg.lower():
+            return None
+
+        hosts_in = host_arg.split(",")
         ports_in = port_arg.split(",")
 
         if len(ports_in) == 1:
@@ -171,92 +327,171 @@ class Rfc2782Resolver:
                 f"cannot match {len(hosts_in)} hosts with {len(ports_in)} port numbers"
             )
 
-        out = []
-        srv_found = False
-        for host, port in zip(hosts_in, ports_in):
-            m = self.re_srv_rr.match(host)
-            if m or port.lower() == "srv":
-                srv_found = True
-                target = m.group("target") if m else None
-                hp = HostPort(host=host, port=port, totry=True, target=target)
-            else:
-                hp = HostPort(host=host, port=port)
-            out.append(hp)
+        targets = [self._get_srv_target(host) for host in hosts_in]
+        totry = [
+            bool(target) or _is_srv_port(port)
+            for target, port in zip(targets, ports_in)
+        ]
+        if not any(totry):
+            return None
 
-        return out if srv_found else []
+        return hosts_in, ports_in, totry, targets
 
-    def _resolve_srv(self, hp: HostPort) -> List[HostPort]:
+    @staticmethod
+    def _get_srv_target(host: str) -> Optional[str]:
+        """
+        Return the Target if the host is in the form _Service._Proto.Target.
+
+        Return None otherwise.
+        """
+        # Cheap test to discard most of the names.
+        if not host.startswith("_"):
+            return None
+
+        parts = host.split(".", 2)
+        if len(parts) != 3:
+            return None
+        service, proto, target = parts
+        if len(service) < 2 or len(proto) < 2 or not proto.startswith("_"):
+            return None
+        # Many connections usually share the same few names.
+        return sys.intern(target) if target else None
+
+    def _resolve_srv(
+        self, host: str, port: str, target: Optional[str]
+    ) -> List[HostPort]:
+        ans = _srv_cache.get(host)
+        if ans is None:
+            ans = self._query_srv(host)
+        return self._get_solved_entries(port, target, ans)
+
+    def _query_srv(self, host: str) -> "Sequence[SRV]":
         try:
-            ans = resolver.resolve(hp.host, "SRV")
+            ans = resolver.resolve(host, "SRV")
         except DNSException:
             ans = ()
-        return self._get_solved_entries(hp, ans)
+            _srv_cache.put_failure(host)
+        else:
+            _srv_cache.put(host, ans)
+        return ans
 
-    async def _resolve_srv_async(self, hp: HostPort) -> List[HostPort]:
+    async def _resolve_srv_async(
+        self, host: str, port: str, target: Optional[str]
+    ) -> List[HostPort]:
+        ans = _srv_cache.get(host)
+        if ans is None:
+            # Join a query for the same name already in progress, if any.
+            loop = asyncio.get_running_loop()
+            fut = _srv_pending.get(host)
+            if fut is None or fut.get_loop() is not loop:
+                fut = _srv_pending[host] = loop.create_task(self._query_srv_async(host))
+            # Don't cancel the query on behalf of other waiters.
+            ans = await asyncio.shield(fut)
+        return self._get_solved_entries(port, target, ans)
+
+    async def _query_srv_async(self, host: str) -> "Sequence[SRV]":
         try:
-            ans = await async_resolver.resolve(hp.host, "SRV")
+            ans = await async_resolver.resolve(host, "SRV")
         except DNSException:
             ans = ()
-        return self._get_solved_entries(hp, ans)
+            _srv_cache.put_failure(host)
+        else:
+            _srv_cache.put(host, ans)
+        finally:
+            if _srv_pending.get(host) is asyncio.current_task():
+                del _srv_pending[host]
+        return ans
 
     def _get_solved_entries(
-        self, hp: HostPort, entries: "Sequence[SRV]"
+        self, port: str, target: Optional[str], entries: "Sequence[SRV]"
     ) -> List[HostPort]:
         if not entries:
             # No SRV entry found. Delegate the libpq a QNAME=target lookup
-            if hp.target and hp.port.lower() != "srv":
-                return [HostPort(host=hp.target, port=hp.port)]
+            if target and not _is_srv_port(port):
+                return [HostPort(target, port)]
             else:
                 return []
 
-        # If there is precisely one SRV RR, and its Target is "." (the root
-        # domain), abort.
-        if len(entries) == 1 and str(entries[0].target) == ".":
-            return []
+        if len(entries) == 1:
+            # If there is precisely one SRV RR, and its Target is "." (the
+            # root domain), abort. Otherwise there is nothing to sort.
+            entry = entries[0]
+            if str(entry.target) == ".":
+                return []
+            return [
+                HostPort(entry.target.to_text(omit_final_dot=True), str(entry.port))
+            ]
 
         return [
-            HostPort(host=str(entry.target).rstrip("."), port=str(entry.port))
+            HostPort(entry.target.to_text(omit_final_dot=True), str(entry.port))
             for entry in self.sort_rfc2782(entries)
         ]
 
     def _return_params(
-        self, params: Dict[str, Any], hps: List[HostPort]
+        self,
+        params: Dict[str, Any],
+        attempts: Attempts,
+        results: Iterator[List[HostPort]],
     ) -> Dict[str, Any]:
-        if not hps:
+        """
+        Return the params with the hosts looked up replaced by the results.
+
+        `!results` must yield a list of resolved hosts for every host to try.
+        """
+        hosts, ports, totry, _ = attempts
+        hosts_out: List[str] = []
+        ports_out: List[str] = []
+        for i in range(len(hosts)):
+            if totry[i]:
+                hps = next(results)
+                hosts_out.extend(map(_get_host, hps))
+                ports_out.extend(map(_get_port, hps))
+            else:
+                hosts_out.append(hosts[i])
+                ports_out.append(ports[i])
+
+        if not hosts_out:
             # Nothing found, we ended up with an empty list
             raise e.OperationalError("no host found after SRV RR lookup")
 
         out = params.copy()
-        out["host"] = ",".join(hp.host for hp in hps)
-        out["port"] = ",".join(str(hp.port) for hp in hps)
+        out["host"] = ",".join(hosts_out)
+        out["port"] = ",".join(ports_out)
         return out
 
     def sort_rfc2782(self, ans: "Sequence[SRV]") -> "List[SRV]":
         """
         Implement the priority/weight ordering defined in RFC 2782.
         """
+        if not ans:
+            return []
+
+        # Usual case: all the entries have the same priority.
+        pri = ans[0].priority
+        if all(entry.priority == pri for entry in ans):
+            return self._weighted_shuffle(list(ans))
+
         # Divide the entries by priority:
-        priorities: DefaultDict[int, "List[SRV]"] = defaultdict(list)
         out: "List[SRV]" = []
-        for entry in ans:
-            priorities[entry.priority].append(entry)
-
-        for pri, entries in sorted(priorities.items()):
-            if len(entries) == 1:
-                out.append(entries[0])
-                continue
-
-            entries.sort(key=lambda ent: ent.weight)
-            total_weight = sum(ent.weight for ent in entries)
-            while entries:
-                r = randint(0, total_weight)
-                csum = 0
-                for i, ent in enumerate(entries):
-                    csum += ent.weight
-                    if csum >= r:
-                        break
-                out.append(ent)
-                total_weight -= ent.weight
-                del entries[i]
+        for _, group in groupby(sorted(ans, key=_get_priority), key=_get_priority):
+            out.extend(self._weighted_shuffle(list(group)))
 
         return out
+
+    def _weighted_shuffle(self, entries: "List[SRV]") -> "List[SRV]":
+        """
+        Order in place entries of the same priority according to their weight.
+        """
+        if len(entries) > 1:
+            # Weighted shuffle (Efraimidis-Spirakis): sorting the entries by
+            # a random exponential key with rate equal to the weight gives the
+            # same order distribution of repeatedly selecting an entry with
+            # probability proportional to its weight, in a single sort.
+            # The entries with weight 0 are used only after all the others.
+            expovariate = _random.expovariate
+            entries.sort(key=lambda ent: expovariate(ent.weight) if ent.weight else inf)
+        return entries
+
+
+# The resolver is stateless: share an instance between the module functions.
+_resolver = Rfc2782Resolver()
@@ -321,33 +321,48 @@ async def resolve_hostaddr_async(params: Dict[str, Any]) -> Dict[str, Any]:
             )
         ports_out = []
 
-    hosts_out = []
-    hostaddr_out = []
-    loop = asyncio.get_running_loop()
+    # The hostaddr of the hosts not requiring a lookup, by position.
+    known_addrs: Dict[int, str] = {}
     for i, host in enumerate(hosts_in):
         if not host or host.startswith("/") or host[1:2] == ":":
             # Local path
-            hosts_out.append(host)
-            hostaddr_out.append("")
-            if ports_in:
-                ports_out.append(ports_in[i])
-            continue
+            known_addrs[i] = ""
+        elif is_ip_address(host):
+            # If the host is already an ip address don't try to resolve it
+            known_addrs[i] = host
 
-        # If the host is already an ip address don't try to resolve it
-        if is_ip_address(host):
+    # Look up all the other host names concurrently.
+    loop = asyncio.get_running_loop()
+    to_resolve = [i for i in range(len(hosts_in)) if i not in known_addrs]
+    answers = await asyncio.gather(
+        *(
+            loop.getaddrinfo(
+                hosts_in[i],
+                ports_in[i] if ports_in else default_port,
+                proto=socket.IPPROTO_TCP,
+                type=socket.SOCK_STREAM,
+            )
+            for i in to_resolve
+        ),
+        return_exceptions=True,
+    )
+    resolved = dict(zip(to_resolve, answers))
+
+    hosts_out = []
+    hostaddr_out = []
+    for i, host in enumerate(hosts_in):
+        if i in known_addrs:
             hosts_out.append(host)
-            hostaddr_out.append(host)
+            hostaddr_out.append(known_addrs[i])
             if ports_in:
                 ports_out.append(ports_in[i])
             continue
 
-        try:
-            port = ports_in[i] if ports_in else default_port
-            ans = await loop.getaddrinfo(
-                host, port, proto=socket.IPPROTO_TCP, type=socket.SOCK_STREAM
-            )
-        except OSError as ex:
-            last_exc = ex
+        ans = resolved[i]
+        if isinstance(ans, OSError):
+            last_exc = ans
+        elif isinstance(ans, BaseException):
+            raise ans
         else:
             for item in ans:
                 hosts_out.append(host)
@@ -427,6 +427,31 @@ async def test_resolve_hostaddr_async_bad(monkeypatch, conninfo, env, fake_resol
         await resolve_hostaddr_async(params)
 
 
+@pytest.mark.asyncio
+async def test_resolve_hostaddr_async_concurrent(monkeypatch):
+    running = []
+    max_running = 0
+
+    async def slow_getaddrinfo(host, port, **kwargs):
+        nonlocal max_running
+        running.append(host)
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(0.01)
+        running.remove(host)
+        if host == "bad.com":
+            raise OSError(f"unknown test host: {host}")
+        addr = {"foo.com": "1.1.1.1", "qux.com": "2.2.2.2"}[host]
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (addr, 432))]
+
+    monkeypatch.setattr(asyncio.get_running_loop(), "getaddrinfo", slow_getaddrinfo)
+    params = conninfo_to_dict("host=foo.com,bad.com,1.2.3.4,qux.com")
+    params = await resolve_hostaddr_async(params)
+    assert params == conninfo_to_dict(
+        "host=foo.com,1.2.3.4,qux.com hostaddr=1.1.1.1,1.2.3.4,2.2.2.2"
+    )
+    assert max_running == 3
+
+
 @pytest.fixture
 async def fake_resolve(monkeypatch):
     fake_hosts = {
@@ -7,8 +7,9 @@ pytestmark = [pytest.mark.dns]
 
 
 @pytest.mark.asyncio
-async def test_resolve_hostaddr_async_warning(recwarn):
+async def test_resolve_hostaddr_async_warning(recwarn, monkeypatch):
     import_dnspython()
+    monkeypatch.setattr(psycopg._dns, "_hostaddr_warned", False)
     conninfo = "dbname=foo"
     params = conninfo_to_dict(conninfo)
     params = await psycopg._dns.resolve_hostaddr_async(  # type: ignore[attr-defined]
@@ -17,6 +18,10 @@ async def test_resolve_hostaddr_async_warning(recwarn):
     assert conninfo_to_dict(conninfo) == params
     assert "resolve_hostaddr_async" in str(recwarn.pop(DeprecationWarning).message)
 
+    # The warning is only emitted once
+    await psycopg._dns.resolve_hostaddr_async(params)  # type: ignore[attr-defined]
+    assert not recwarn
+
 
 def import_dnspython():
     try:
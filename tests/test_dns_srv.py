@@ -1,4 +1,7 @@
-from typing import List, Union
+import time
+import asyncio
+import threading
+from typing import Any, List, Optional, Union
 
 import pytest
 
@@ -94,6 +97,215 @@ async def test_srv_bad_async(conninfo, env, afake_srv, monkeypatch):
         await psycopg._dns.resolve_srv_async(params)  # type: ignore[attr-defined]
 
 
+@pytest.mark.parametrize(
+    "host, target",
+    [
+        ("_pg._tcp.foo.com", "foo.com"),
+        ("_pg._tcp.foo", "foo"),
+        ("_pg._tcp.", None),
+        ("_pg._tcp", None),
+        ("_._tcp.foo.com", None),
+        ("_pg._.foo.com", None),
+        ("_pg.tcp.foo.com", None),
+        ("pg._tcp.foo.com", None),
+        ("foo.com", None),
+        ("", None),
+    ],
+)
+def test_srv_target(host, target):
+    import_dnspython()
+    rv = psycopg._dns.Rfc2782Resolver._get_srv_target(host)  # type: ignore
+    assert rv == target
+
+
+def test_sort_rfc2782():
+    import_dnspython()
+    from dns.rdtypes.IN.SRV import SRV
+
+    entries = [
+        SRV("IN", "SRV", pri, w, 5432, f"db{i}.example.com.")
+        for i, (pri, w) in enumerate([(1, 0), (1, 10), (0, 0), (1, 20), (1, 0)])
+    ]
+    for i in range(20):
+        out = psycopg._dns.Rfc2782Resolver().sort_rfc2782(entries)  # type: ignore
+        assert sorted(out, key=id) == sorted(entries, key=id)
+        assert [e.priority for e in out] == [0, 1, 1, 1, 1]
+        assert [e.weight for e in out][3:] == [0, 0]
+
+
+def test_srv_cache(fake_srv, monkeypatch):
+    calls = []
+    f = psycopg._dns.resolver.resolve  # type: ignore[attr-defined]
+
+    def counting_f(qname, rdtype):
+        calls.append(qname)
+        return f(qname, rdtype)
+
+    monkeypatch.setattr(
+        psycopg._dns.resolver, "resolve", counting_f  # type: ignore[attr-defined]
+    )
+    params = conninfo_to_dict("host=_pg._tcp.foo.com,_pg._tcp.baz.com")
+    for i in range(3):
+        rv = psycopg._dns.resolve_srv(params)  # type: ignore[attr-defined]
+        assert rv["host"] == "db1.example.com,baz.com"
+
+    # The failed lookup is cached too
+    assert calls == ["_pg._tcp.foo.com", "_pg._tcp.baz.com"]
+
+
+def test_srv_cache_expire(fake_srv, monkeypatch):
+    cache = psycopg._dns._srv_cache  # type: ignore[attr-defined]
+    cache.put("_pg._tcp.foo.com", FakeAnswer([], ttl=10))
+    assert cache.get("_pg._tcp.foo.com") == []
+
+    now = psycopg._dns.monotonic()  # type: ignore[attr-defined]
+    monkeypatch.setattr(psycopg._dns, "monotonic", lambda: now + 11)
+    assert cache.get("_pg._tcp.foo.com") is None
+
+
+def test_srv_cache_dnspython_cached(fake_srv, monkeypatch):
+    # An answer served by the dnspython cache has the original records TTL
+    # but it expires sooner.
+    calls = []
+
+    def cached_f(qname, rdtype):
+        calls.append(qname)
+        rv = FakeAnswer([], ttl=3600, expiration=time.time() + 1)
+        rv.extend(f(qname, rdtype))
+        return rv
+
+    f = psycopg._dns.resolver.resolve  # type: ignore[attr-defined]
+    monkeypatch.setattr(
+        psycopg._dns.resolver, "resolve", cached_f  # type: ignore[attr-defined]
+    )
+    params = conninfo_to_dict("host=_pg._tcp.foo.com")
+    psycopg._dns.resolve_srv(params)  # type: ignore[attr-defined]
+    psycopg._dns.resolve_srv(params)  # type: ignore[attr-defined]
+    assert len(calls) == 1
+
+    now = psycopg._dns.monotonic()  # type: ignore[attr-defined]
+    monkeypatch.setattr(psycopg._dns, "monotonic", lambda: now + 2)
+    rv = psycopg._dns.resolve_srv(params)  # type: ignore[attr-defined]
+    assert rv["host"] == "db1.example.com"
+    assert len(calls) == 2
+
+
+def test_srv_cache_failure_backoff(fake_srv, monkeypatch):
+    cache = psycopg._dns._srv_cache  # type: ignore[attr-defined]
+    now = psycopg._dns.monotonic()  # type: ignore[attr-defined]
+    monkeypatch.setattr(psycopg._dns, "monotonic", lambda: now)
+
+    backoffs = []
+    for i in range(6):
+        cache.put_failure("_pg._tcp.baz.com")
+        assert cache.get("_pg._tcp.baz.com") == ()
+        backoffs.append(cache._entries["_pg._tcp.baz.com"][2])
+        now += backoffs[-1]
+        assert cache.get("_pg._tcp.baz.com") is None
+
+    assert backoffs == [5, 10, 20, 40, 60, 60]
+
+    # A success resets the backoff
+    cache.put("_pg._tcp.baz.com", FakeAnswer([], ttl=1))
+    now += 1
+    cache.put_failure("_pg._tcp.baz.com")
+    assert cache._entries["_pg._tcp.baz.com"][2] == 5
+
+
+def test_srv_cache_lru():
+    import_dnspython()
+    cache = psycopg._dns.SrvCache(maxsize=2)  # type: ignore[attr-defined]
+    cache.put("a", FakeAnswer([]))
+    cache.put("b", FakeAnswer([]))
+    assert cache.get("a") == []
+    cache.put("c", FakeAnswer([]))
+    assert cache.get("a") == []
+    assert cache.get("b") is None
+    assert cache.get("c") == []
+
+
+def test_srv_concurrent(fake_srv, monkeypatch):
+    lock = threading.Lock()
+    running = []
+    max_running = 0
+    f = psycopg._dns.resolver.resolve  # type: ignore[attr-defined]
+
+    def slow_f(qname, rdtype):
+        nonlocal max_running
+        with lock:
+            running.append(qname)
+            max_running = max(max_running, len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(qname)
+            calls.append(qname)
+        return f(qname, rdtype)
+
+    calls: List[str] = []
+    monkeypatch.setattr(
+        psycopg._dns.resolver, "resolve", slow_f  # type: ignore[attr-defined]
+    )
+    params = conninfo_to_dict(
+        "host=_pg._tcp.foo.com,foo.com,_pg._tcp.dot.com,_pg._tcp.foo.com"
+    )
+    rv = psycopg._dns.resolve_srv(params)  # type: ignore[attr-defined]
+    assert rv["host"] == "db1.example.com,foo.com,db1.example.com"
+    assert max_running == 2
+    assert sorted(calls) == ["_pg._tcp.dot.com", "_pg._tcp.foo.com"]
+
+
+def test_srv_cache_contains(fake_srv, monkeypatch):
+    cache = psycopg._dns._srv_cache  # type: ignore[attr-defined]
+    cache.put("a", FakeAnswer([], ttl=10))
+    cache.put("b", FakeAnswer([], ttl=10))
+    assert "a" in cache
+    assert "c" not in cache
+
+    # The order is not changed: "a" is still the least recently used
+    cache.maxsize = 2
+    cache.put("c", FakeAnswer([], ttl=10))
+    assert "a" not in cache
+    assert "b" in cache
+
+    now = psycopg._dns.monotonic()  # type: ignore[attr-defined]
+    monkeypatch.setattr(psycopg._dns, "monotonic", lambda: now + 11)
+    assert "b" not in cache
+
+
+@pytest.mark.asyncio
+async def test_srv_async_single_query(afake_srv, monkeypatch):
+    calls = []
+    f = psycopg._dns.async_resolver.resolve  # type: ignore[attr-defined]
+
+    async def counting_f(qname, rdtype):
+        calls.append(qname)
+        await asyncio.sleep(0.01)
+        return await f(qname, rdtype)
+
+    monkeypatch.setattr(
+        psycopg._dns.async_resolver,  # type: ignore[attr-defined]
+        "resolve",
+        counting_f,
+    )
+    params = conninfo_to_dict("host=_pg._tcp.foo.com")
+    rvs = await asyncio.gather(
+        *(
+            psycopg._dns.resolve_srv_async(params)  # type: ignore[attr-defined]
+            for i in range(3)
+        )
+    )
+    assert [rv["host"] for rv in rvs] == ["db1.example.com"] * 3
+    assert calls == ["_pg._tcp.foo.com"]
+
+
+class FakeAnswer(list):  # type: ignore[type-arg]
+    def __init__(
+        self, items: List[Any], ttl: int = 60, expiration: Optional[float] = None
+    ):
+        super().__init__(items)
+        self.expiration = time.time() + ttl if expiration is None else expiration
+
+
 @pytest.fixture
 def fake_srv(monkeypatch):
     f = get_fake_srv_function(monkeypatch)
@@ -121,6 +333,10 @@ def afake_srv(monkeypatch):
 def get_fake_srv_function(monkeypatch):
     import_dnspython()
 
+    monkeypatch.setattr(
+        psycopg._dns, "_srv_cache", psycopg._dns.SrvCache()  # type: ignore
+    )
+
     from dns.rdtypes.IN.A import A
     from dns.rdtypes.IN.SRV import SRV
     from dns.exception import DNSException
@@ -152,6 +368,6 @@ def get_fake_srv_function(monkeypatch):
                 pri, w, port, target = entry.split()
                 rv.append(SRV("IN", "SRV", int(pri), int(w), int(port), target))
 
-        return rv
+        return FakeAnswer(rv)
 
     return fake_srv_